@@ -1,22 +1,32 @@
 # bgg_crawl_api_regex.py
 # -*- coding: utf-8 -*-
 """
-Crawler สำหรับ BoardGameGeek แบบใช้ API แต่ "พาร์สด้วย REGEX จาก resp.text" (ไม่ใช้ resp.json()):
-- ดึงรายชื่อ "หมวด (categories)" จากหน้า index (requests + regex)
+Crawler สำหรับ BoardGameGeek แบบใช้ API (พาร์สด้วย resp.json()):
+- ดึงรายชื่อ "หมวด (categories)" จากหน้า index (httpx + regex)
 - เลือกช่วงหมวดด้วย START_CATEGORY..END_CATEGORY (exclusive)
-- ต่อหมวด: เรียก API /api/geekitem/linkeditems แล้วแตก items ด้วย regex
-- เลือกเอารูปจากฟิลด์ใน API (regex) และอัปเกรดรูปด้วย og:image (optional)
-- กัน rate-limit: random delay + exponential backoff 429/5xx
+- ต่อหมวด: เรียก API /api/geekitem/linkeditems แล้วอ่าน items จาก JSON
+- เลือกเอารูปจากฟิลด์ใน API และอัปเกรดรูปด้วย og:image (optional)
+- ยิง request พร้อมกันด้วย asyncio + httpx.AsyncClient (HTTP/2, จำกัดด้วย HTTP_CONCURRENCY)
+- ทุกหมวดวิ่งพร้อมกัน แต่คัดเกม/กันซ้ำตามลำดับหมวด (ผลลัพธ์คงที่เหมือนไล่ทีละหมวด)
+- กัน rate-limit: token bucket ต่อ host (API_RATE / DETAIL_RATE) + Retry-After + backoff 429/5xx
 - บันทึก CSV: [category, name, year, url, image_url]
 """
 
 import re
 import csv
-import time
 import html
+import json
+import time
 import random
-import requests
-from urllib.parse import urljoin
+import sqlite3
+import asyncio
+import httpx
+
+try:
+    # ไม่บังคับ: ถ้ามี selectolax จะใช้พาร์สหน้า index (lexbor, C) แทน CAT_RE
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
 
 # ----------------------------
 # Config
@@ -36,152 +46,237 @@ TARGET_PER_CAT     = 50
 # อัปเกรดภาพจากหน้าเกม (ดึง og:image)
 UPGRADE_IMAGES       = True
 MAX_UPGRADE_PER_CAT  = 120
-UPGRADE_DELAY_RANGE  = (0.25, 0.5)  # หน่วงสุ่มระหว่างอัปเกรดภาพ/ต่อเกม
+DETAIL_RATE          = 4  # request/วินาที สูงสุดไปที่หน้าเกม boardgamegeek.com
 
-# ระยะห่างระหว่างเรียก API เพื่อลดโอกาสโดน 429
-API_DELAY_RANGE      = (0.2, 0.4)
+# จังหวะเรียก API เพื่อลดโอกาสโดน 429 (limiter ต่อ host ดู HOST_LIMITERS)
+API_RATE             = 5  # request/วินาที สูงสุดไปที่ api.geekdo.com
+
+# แคช response ของ API ลงดิสก์ (sqlite) ไว้ใช้ตอนรันซ้ำ, None = ปิดแคช
+API_CACHE_PATH       = "bgg_api_cache.sqlite"
+API_CACHE_TTL        = 24 * 3600  # วินาที
+
+# จำนวน request ที่บินพร้อมกันได้สูงสุด (ทั้ง API และหน้าเกม)
+HTTP_CONCURRENCY     = 64
+HTTP_KEEPALIVE       = 32
+HTTP_HEADERS         = {"User-Agent": "Mozilla/5.0"}
 
 # ไฟล์ผลลัพธ์
 OUTFILE = "boardgame_categories_with_images_by_api_regex.csv"
+OUTFILE_PARQUET = None  # เช่น "boardgame_categories.parquet" (ต้องมี pyarrow), None = ไม่เขียน
+OUT_COLUMNS = ["category", "name", "year", "url", "image_url"]
 
 # ----------------------------
 # Regex (HTML: หน้า index)
 # ----------------------------
 CAT_RE = re.compile(r'href="(/boardgamecategory/\d+/[^"]+)"[^>]*>([^<]+)</a>')
+CAT_ID_RE = re.compile(r"/boardgamecategory/(\d+)")
+CAT_HREF_RE = re.compile(r"/boardgamecategory/\d+/.")
 
-OG_IMG_RE   = re.compile(
-    r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']',
+# หน้าเกม: ค้นบน bytes ตรง ๆ (resp.content) ไม่ต้อง decode HTML ทั้งหน้าเป็น str
+OG_IMG_RE_B   = re.compile(
+    rb'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']',
     re.IGNORECASE
 )
-LINK_IMG_RE = re.compile(
-    r'<link[^>]+rel=["\']image_src["\'][^>]+href=["\']([^"\']+)["\']',
+LINK_IMG_RE_B = re.compile(
+    rb'<link[^>]+rel=["\']image_src["\'][^>]+href=["\']([^"\']+)["\']',
     re.IGNORECASE
 )
 
-TAG_RE  = re.compile(r"<[^>]+>")
-WS_RE   = re.compile(r"\s+")
-
 # ----------------------------
-# Regex (API: พาร์สจาก resp.text)
+# Utils
 # ----------------------------
 
-# หา array ของ items ภายใน object response
-ARRAY_IN_OBJECT_RE = re.compile(
-    r'"(?:items|linkeditems|results)"\s*:\s*(\[(?:.|\n|\r)*?\])',
-    re.IGNORECASE
-)
+class RateLimiter:
+    """
+    token bucket แบบ async: ปล่อยได้ไม่เกิน rate ครั้งต่อ per วินาที (burst ได้ไม่เกิน rate)
+    ใช้: await limiter.acquire() หรือ async with limiter: ...
+    """
+    def __init__(self, rate: float, per: float = 1.0):
+        self.rate = rate
+        self.per = per
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate / self.per)
+        self._last = now
+
+    async def acquire(self):
+        # ถือ lock ระหว่างรอ เพื่อให้คิวออกตามลำดับที่มาถึง
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.per / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def pause(self, seconds: float):
+        # server บอกให้รอ (Retry-After): ทุกคนในคิวหยุดรอถึงเส้นตายเดียวกัน
+        # ใช้ max ไม่บวกสะสม: 429 หลายตัวพร้อมกันจาก Retry-After เดียวกันต้องรอแค่ครั้งเดียว
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+class ResponseCache:
+    """
+    แคช body ของ response ลง sqlite คีย์ด้วย URL เต็ม (รวม query string)
+    ค่าที่เก่ากว่า ttl วินาทีถือว่าหมดอายุ
+    """
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, fetched_at REAL, body TEXT)"
+        )
+
+    def get(self, url: str) -> str | None:
+        row = self._db.execute("SELECT fetched_at, body FROM responses WHERE url = ?", (url,)).fetchone()
+        if row and time.time() - row[0] < self.ttl:
+            return row[1]
+        return None
 
-# split objects ชั้นบนใน array (สมมุติว่าไม่มี '}{' ชิดกันใน nested object)
-TOP_OBJECT_SPLIT_RE = re.compile(r'\}\s*,\s*\{')
-
-# ยูทิลิตี้สร้าง regex สำหรับชนิดค่าต่าง ๆ
-def _rx_str(key):
-    # จับสตริง JSON โดยยอมให้มีอักขระ escape ภายใน เช่น \" \\ \n \uXXXX
-    return re.compile(
-        rf'"{re.escape(key)}"\s*:\s*"((?:\\.|[^"\\])*)"',
-        re.IGNORECASE
-    )
-
-def _rx_num(key):  return re.compile(rf'"{re.escape(key)}"\s*:\s*"?(-?\d+(?:\.\d+)?)"?', re.IGNORECASE)
-def _rx_bool(key): return re.compile(rf'"{re.escape(key)}"\s*:\s*(true|false)', re.IGNORECASE)
-
-# ฟิลด์ที่สนใจ
-RX_ID_OBJID = re.compile(r'"(?:objectid|id)"\s*:\s*"?(\d+)"?', re.IGNORECASE)
-RX_NAME     = _rx_str("name")
-RX_YEAR     = _rx_num("yearpublished")
-RX_HREF     = _rx_str("href")
-RX_URL      = _rx_str("url")
-RX_SUBTYPE  = _rx_str("subtype")
-RX_TYPE     = _rx_str("type")
-
-# รูป: images.original (เจอบ่อยสุดใน BGG)
-RX_IMG_ORIGINAL = re.compile(
-    r'"images"\s*:\s*\{[^{}]*?"original"\s*:\s*"(.*?)"',
-    re.IGNORECASE | re.DOTALL
-)
-RX_IMAGEURL = _rx_str("imageurl")
-RX_IMAGE    = _rx_str("image")
+    def put(self, url: str, body: str):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (url, time.time(), body))
 
-# ----------------------------
-# Utils
-# ----------------------------
+    def close(self):
+        self._db.close()
 
-# แปลง \uXXXX และ escape อื่น ๆ ในสตริง JSON ที่เราไม่ได้ใช้ json.loads
-_hex_esc_re = re.compile(r'\\u([0-9a-fA-F]{4})')
-def unescape_json_unicode(s: str) -> str:
-    if not s:
-        return s
-    s = _hex_esc_re.sub(lambda m: chr(int(m.group(1), 16)), s)
-    # แปลง escape ทั่วไป
-    s = s.replace(r'\"', '"').replace(r"\/", "/").replace(r"\\", "\\")
-    s = s.replace(r"\b", "\b").replace(r"\f", "\f").replace(r"\n", "\n").replace(r"\r", "\r").replace(r"\t", "\t")
-    return s
+# limiter กลางต่อ host: ทุก request ผ่าน http_get แล้วถูกคุมจังหวะที่นี่ที่เดียว
+# status ที่ควรลองใหม่ (Retry-After ของ status เหล่านี้ไปหยุด limiter)
+RETRY_STATUSES = (429, 502, 503, 504)
+HOST_LIMITERS = {
+    "api.geekdo.com": RateLimiter(API_RATE),
+    "boardgamegeek.com": RateLimiter(DETAIL_RATE),
+}
 
-# หา id จากลิงก์
-ID_RE = re.compile(r"/boardgame(?:expansion)?/(\d+)")
+def retry_after_seconds(resp: httpx.Response) -> float | None:
+    v = resp.headers.get("Retry-After")
+    try:
+        return float(v) if v else None
+    except ValueError:
+        return None
+
+async def http_get(client: httpx.AsyncClient, sem: asyncio.Semaphore, url: str, **kwargs) -> httpx.Response:
+    """
+    GET ผ่าน limiter ของ host นั้น แล้วค่อยจองที่ใน semaphore
+    ถ้าโดน 429/5xx พร้อม Retry-After จะหยุด limiter ของ host นั้นตามเวลาที่ server ขอ
+    (limiter เป็นที่เดียวที่รอ Retry-After ผู้เรียกไม่ต้อง sleep ซ้ำ)
+    """
+    limiter = HOST_LIMITERS.get(httpx.URL(url).host)
+    if limiter is not None:
+        await limiter.acquire()
+    async with sem:
+        resp = await client.get(url, **kwargs)
+    if resp.status_code in RETRY_STATUSES and limiter is not None:
+        wait = retry_after_seconds(resp)
+        if wait:
+            limiter.pause(wait)
+    return resp
+
+# หา id จากลิงก์ (/boardgame/<id>/... หรือ /boardgameexpansion/<id>/...) ด้วย str.find แทน regex
+GAME_PATH_PREFIXES = ("/boardgame/", "/boardgameexpansion/")
+
+def id_from_url(v: str) -> int | None:
+    for prefix in GAME_PATH_PREFIXES:
+        i = v.find(prefix)
+        if i >= 0:
+            seg = v[i + len(prefix):].partition("/")[0]
+            if seg.isascii() and seg.isdigit():
+                return int(seg)
+    return None
 
 def clean_text(s: str) -> str:
-    s = html.unescape(TAG_RE.sub("", s))
-    s = WS_RE.sub(" ", s)
-    return s.strip()
+    # CAT_RE จับ [^<]+ มาแล้ว ไม่มีแท็กเหลือ: แค่ unescape แล้วยุบช่องว่าง (split() ทำใน C)
+    return " ".join(html.unescape(s).split())
 
 def to_abs(path: str) -> str:
+    # SITE_ROOT คงที่และ path จาก BGG ขึ้นต้นด้วย "/" เสมอ: ต่อสตริงตรง ๆ ไม่ต้อง urljoin
     if not path:
         return ""
-    if path.startswith("//"):
-        return "https:" + path
-    if path.startswith("/"):
-        return urljoin(SITE_ROOT, path)
+    if path[0] == "/":
+        if path[:2] == "//":
+            return "https:" + path
+        return SITE_ROOT + path
     return path
 
-def extract_categories_from_index(session: requests.Session) -> list[tuple[str, str]]:
+def iter_category_links(html_src: str):
+    """
+    ไล่ลิงก์หมวดในหน้า index คืน (rel_url, name)
+    ใช้ selectolax ถ้าติดตั้งไว้ ไม่งั้นใช้ CAT_RE
+    """
+    if HTMLParser is not None:
+        for node in HTMLParser(html_src).css('a[href^="/boardgamecategory/"]'):
+            rel = node.attributes.get("href") or ""
+            if CAT_HREF_RE.match(rel):
+                # node.text() decode entities มาแล้ว เหลือแค่ยุบช่องว่าง
+                yield rel, " ".join(node.text().split())
+    else:
+        for m in CAT_RE.finditer(html_src):
+            yield m.group(1), clean_text(m.group(2))
+
+async def extract_categories_from_index(client: httpx.AsyncClient) -> list[tuple[str, str]]:
     """
     ดึงรายชื่อหมวดจากหน้า index (HTML) อย่างเบา ๆ
     คืน: [(category_name, category_url_abs), ...]
     """
-    r = session.get(INDEX_URL, timeout=20, headers={"User-Agent": "Mozilla/5.0"})
+    r = await client.get(INDEX_URL, timeout=20)
     r.raise_for_status()
     html_src = r.text
 
     cats, seen = [], set()
-    for m in CAT_RE.finditer(html_src):
-        rel = m.group(1)
-        name = clean_text(m.group(2))
+    for rel, name in iter_category_links(html_src):
         if not name:
             continue
-        abs_url = urljoin(SITE_ROOT, rel)
+        abs_url = to_abs(rel)
         if abs_url not in seen:
             seen.add(abs_url)
             cats.append((name, abs_url))
     return cats
 
 def extract_category_id(cat_url: str) -> int | None:
-    m = re.search(r"/boardgamecategory/(\d+)", cat_url)
+    m = CAT_ID_RE.search(cat_url)
     return int(m.group(1)) if m else None
 
 def get_game_id(it: dict) -> int | None:
     gid = it.get("objectid") or it.get("id")
-    if isinstance(gid, str) and gid.isdigit():
-        return int(gid)
     if isinstance(gid, int):
         return gid
+    if isinstance(gid, str) and gid.isdigit():
+        return int(gid)
+    # ไม่มี id ในฟิลด์ตรง ๆ ค่อยแงะจากลิงก์
     for k in ("href", "url"):
-        v = it.get(k) or ""
-        m = ID_RE.search(v)
-        if m:
-            try:
-                return int(m.group(1))
-            except Exception:
-                pass
+        v = it.get(k)
+        if v:
+            gid = id_from_url(v)
+            if gid:
+                return gid
     return None
 
+EXPANSION_SUBTYPE = "boardgameexpansion"
+
 def is_expansion(it: dict) -> bool:
-    st = (it.get("subtype") or it.get("type") or "").lower()
-    if st == "boardgameexpansion":
+    st = it.get("subtype") or it.get("type") or ""
+    # API ส่งมาเป็นตัวเล็กอยู่แล้ว: เทียบตรง ๆ ก่อน ค่อย lower() เมื่อความยาวตรงกันเท่านั้น
+    if st == EXPANSION_SUBTYPE or (len(st) == len(EXPANSION_SUBTYPE) and st.lower() == EXPANSION_SUBTYPE):
         return True
+    # path บน BGG เป็นตัวเล็กเสมอ ไม่ต้อง lower()
     for k in ("href", "url"):
-        v = (it.get(k) or "").lower()
-        if "/boardgameexpansion/" in v:
+        v = it.get(k)
+        if v and "/boardgameexpansion/" in v:
             return True
     return False
 
@@ -216,204 +311,75 @@ def item_url(it: dict) -> str:
         return to_abs(f"/boardgame/{gid}")
     return ""
 
-def fetch_detail_image_http(url: str, session: requests.Session, timeout=20) -> str:
+async def fetch_detail_image_http(url: str, client: httpx.AsyncClient, sem: asyncio.Semaphore, timeout=20) -> str:
     try:
-        r = session.get(url, timeout=timeout, headers={"User-Agent": "Mozilla/5.0"})
+        r = await http_get(client, sem, url, timeout=timeout)
         r.raise_for_status()
-        m = OG_IMG_RE.search(r.text) or LINK_IMG_RE.search(r.text)
+        body = r.content
+        m = None
+        # เช็ค substring ก่อน (memmem ใน C): ไม่มี og:image ก็ไม่ต้องให้ regex เดินทั้งหน้า
+        # regex เป็น IGNORECASE จึงหาใน body ตัวพิมพ์เล็ก (lower() ก็ทำใน C) ไม่งั้น og:Image จะหลุด
+        lowered = body.lower()
+        i = lowered.find(b"og:image")
+        if i >= 0:
+            # เริ่มค้นที่ '<' ของแท็กที่มี og:image เลย ไม่ต้องไล่ตั้งแต่ต้นหน้า
+            m = OG_IMG_RE_B.search(body, max(body.rfind(b"<", 0, i), 0))
+        if not m and b"image_src" in lowered:
+            m = LINK_IMG_RE_B.search(body)
         if m:
-            return to_abs(m.group(1).strip())
+            # decode เฉพาะ URL ที่จับได้
+            return to_abs(m.group(1).strip().decode("utf-8", "replace"))
     except Exception:
         pass
     return ""
 
 # ----------------------------
-# พาร์สรายการจาก API resp.text ด้วย regex
+# พาร์สรายการจาก API (JSON)
 # ----------------------------
-def _slice_array_after_key(text: str, key_regex: re.Pattern) -> str | None:
-    """
-    หา array ที่ตามหลังคีย์ (เช่น "items": [ ... ]) แล้วคืนซับสตริงตั้งแต่ '[' ถึง ']' ที่ depth=0
-    ใช้วิธีนับวงเล็บ [] ให้ครบคู่ (ข้ามในสตริง)
-    """
-    m = key_regex.search(text)
-    if not m:
-        return None
-    i = m.end()          # ชี้หลัง '[' ตัวแรก (เพราะ regex รวม '[' ไว้แล้ว)
-    # ย้อนกลับหนึ่งตัวเพื่อให้เริ่มที่ '[' จริง ๆ
-    i -= 1
-    if i < 0 or text[i] != '[':
-        # กันเผื่อ regex ไม่ตรง
-        while i < len(text) and text[i] != '[':
-            i += 1
-        if i >= len(text):
-            return None
-
-    depth = 0
-    in_str = False
-    esc = False
-    start = i
-    for j in range(i, len(text)):
-        ch = text[j]
-        if in_str:
-            if esc:
-                esc = False
-            elif ch == '\\':
-                esc = True
-            elif ch == '"':
-                in_str = False
-            continue
-        else:
-            if ch == '"':
-                in_str = True
-                continue
-            if ch == '[':
-                depth += 1
-            elif ch == ']':
-                depth -= 1
-                if depth == 0:
-                    return text[start:j+1]
-    return None
+ITEMS_KEYS = ("items", "linkeditems", "results")
 
+_json_decoder = json.JSONDecoder()
 
-def _split_array_items_jsonish(array_text: str) -> list[str]:
+def decode_api_json(text: str):
     """
-    รับสตริงของ array เช่น: [{...}, {...}, {...}] แล้วคืนลิสต์ของชิ้น object ชั้นบน
-    ใช้นับวงเล็บ { } และข้ามในสตริง
+    decode JSON ของ API; ถ้ามีขยะหน้า/หลัง (เช่น JSONP หรือข้อความต่อท้าย)
+    ใช้ raw_decode (C) เริ่มที่ '{' หรือ '[' ตัวแรก แทนการไล่นับวงเล็บเองใน Python
     """
-    s = array_text.strip()
-    if s.startswith('['):
-        s = s[1:]
-    if s.endswith(']'):
-        s = s[:-1]
-
-    parts = []
-    depth = 0
-    in_str = False
-    esc = False
-    obj_start = None
-
-    for idx, ch in enumerate(s):
-        if in_str:
-            if esc:
-                esc = False
-            elif ch == '\\':
-                esc = True
-            elif ch == '"':
-                in_str = False
-            continue
-
-        if ch == '"':
-            in_str = True
-            continue
-
-        if ch == '{':
-            if depth == 0:
-                obj_start = idx
-            depth += 1
-        elif ch == '}':
-            depth -= 1
-            if depth == 0 and obj_start is not None:
-                parts.append(s[obj_start:idx+1])
-                obj_start = None
-        # เครื่องหมายคอมม่าไม่ต้องทำอะไร เพราะเราตัดตาม depth=0 อยู่แล้ว
-
-    return parts
-
-
-def parse_api_items_from_text(text: str) -> list[dict]:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+        if not starts:
+            raise
+        return _json_decoder.raw_decode(text, min(starts))[0]
+
+def parse_api_items(data) -> list[dict]:
     """
-    พาร์ส resp.text: หาชุด "items": [ ... ] แบบนับวงเล็บ แล้วแตก object ชั้นบนอย่างปลอดภัย
-    จากนั้นดึงฟิลด์สำคัญด้วย regex ตามเดิม
+    รับ JSON ที่ decode แล้ว (dict หรือ list) คืนลิสต์ของ item (dict)
+    รองรับทั้งแบบ {"items": [...]} / {"linkeditems": [...]} / {"results": [...]} และ array ตรง ๆ
     """
-    if not text:
-        return []
-
-    # 1) หา array ของ items โดยนับวงเล็บ แทน non-greedy regex
-    key_rx = re.compile(r'"(?:items|linkeditems|results)"\s*:\s*\[', re.IGNORECASE)
-    array_text = None
-
-    stripped = text.lstrip()
-    if stripped.startswith('['):
-        # ทั้งไฟล์เป็น array
-        array_text = _slice_array_after_key('items:' + text, re.compile(r'items:\[', re.IGNORECASE))
-    else:
-        array_text = _slice_array_after_key(text, key_rx)
-
-    if not array_text:
-        return []
-
-    # 2) แยก object ชั้นบนทุกชิ้นใน array
-    raw_objs = _split_array_items_jsonish(array_text)
-    if not raw_objs:
-        return []
-
-    items: list[dict] = []
-
-    for chunk in raw_objs:
-        item: dict = {}
-
-        # id/objectid
-        m = RX_ID_OBJID.search(chunk)
-        if m:
-            gid = int(m.group(1))
-            item["id"] = gid
-            item["objectid"] = gid
-
-        # name (แปลง \uXXXX → อักขระจริง)
-        m = RX_NAME.search(chunk)
-        if m:
-            item["name"] = unescape_json_unicode(m.group(1))
-
-        # year (อาจ quoted)
-        m = RX_YEAR.search(chunk)
-        if m:
-            try:
-                item["yearpublished"] = int(float(m.group(1)))
-            except Exception:
-                pass
-
-        # href/url (แก้ \/ → /)
-        m = RX_HREF.search(chunk)
-        if m:
-            item["href"] = unescape_json_unicode(m.group(1))
-        m = RX_URL.search(chunk)
-        if m and "url" not in item:
-            item["url"] = unescape_json_unicode(m.group(1))
-
-        # subtype/type
-        m = RX_SUBTYPE.search(chunk)
-        if m:
-            item["subtype"] = m.group(1)
-        m = RX_TYPE.search(chunk)
-        if m and "type" not in item:
-            item["type"] = m.group(1)
-
-        # รูป
-        m = RX_IMG_ORIGINAL.search(chunk)
-        if m:
-            item["images_original"] = unescape_json_unicode(m.group(1))
+    if isinstance(data, dict):
+        for k in ITEMS_KEYS:
+            if isinstance(data.get(k), list):
+                data = data[k]
+                break
         else:
-            m = RX_IMAGEURL.search(chunk)
-            if m:
-                item["imageurl"] = unescape_json_unicode(m.group(1))
-            else:
-                m = RX_IMAGE.search(chunk)
-                if m:
-                    item["image"] = unescape_json_unicode(m.group(1))
-
-        items.append(item)
-
-    return items
+            return []
+    if not isinstance(data, list):
+        return []
+    return [it for it in data if isinstance(it, dict)]
 
 # ----------------------------
-# API Calls (fetch -> regex parse)
+# API Calls (fetch -> JSON parse)
 # ----------------------------
 API_BASE = "https://api.geekdo.com/api/geekitem/linkeditems"
 
-def api_fetch_page(session: requests.Session, *, objectid: int, pageid: int, showcount: int, sort="name", subtype="boardgamecategory") -> list[dict]:
+async def api_fetch_page(client: httpx.AsyncClient, sem: asyncio.Semaphore, *, objectid: int, pageid: int, showcount: int, sort="name", subtype="boardgamecategory",
+                         cache: ResponseCache | None = None) -> list[dict]:
     """
     เรียกหน้าเดียวของรายการเกมที่ลิงก์กับหมวด (property)
-    คืน list ของ item (dict) ที่ได้จากการ "regex พาร์ส resp.text"
+    คืน list ของ item (dict) ที่ได้จาก resp.json()
+    ถ้ามี cache และเจอหน้าเดิมที่ยังไม่หมดอายุ จะไม่ยิง network (และไม่ติด rate limit)
     """
     params = {
         "ajax": 1,
@@ -427,126 +393,207 @@ def api_fetch_page(session: requests.Session, *, objectid: int, pageid: int, sho
         "subtype": subtype,
     }
 
+    key = str(httpx.URL(API_BASE, params=params))
+    if cache is not None:
+        body = cache.get(key)
+        if body is not None:
+            return parse_api_items(decode_api_json(body))
+
     for attempt in range(6):
         try:
-            resp = session.get(API_BASE, params=params, timeout=25, headers={"User-Agent": "Mozilla/5.0"})
+            resp = await http_get(client, sem, API_BASE, params=params, timeout=25)
             status = resp.status_code
-            if status in (429, 502, 503, 504):
-                wait = (attempt + 1) * 2 + random.random()
-                print(f"  API {status}, backoff {wait:.1f}s ...")
-                time.sleep(wait)
+            if status in RETRY_STATUSES:
+                # มี Retry-After: http_get หยุด limiter ไว้แล้ว รอบหน้า acquire() จะรอเอง
+                if retry_after_seconds(resp) is None:
+                    wait = (attempt + 1) * 2 + random.random()
+                    print(f"  API {status}, backoff {wait:.1f}s ...")
+                    await asyncio.sleep(wait)
+                else:
+                    print(f"  API {status}, waiting Retry-After ...")
                 continue
             resp.raise_for_status()
 
-            # ใช้ regex จาก resp.text
-            # print(resp.text)
-            items = parse_api_items_from_text(resp.text)
-            # print(f"Parsed items22: {items}")
-            return items or []
+            # decode ด้วย json (C extension) แทนการไล่ regex ทีละฟิลด์
+            items = parse_api_items(decode_api_json(resp.text))
+            if cache is not None:
+                cache.put(key, resp.text)
+            return items
         except Exception as e:
             wait = (attempt + 1) * 1.5 + random.random()
             print(f"  API error: {e}; retry in {wait:.1f}s")
-            time.sleep(wait)
+            await asyncio.sleep(wait)
     return []
 
 # ----------------------------
 # Crawl
 # ----------------------------
-def crawl_category_via_api(category_name: str, category_id: int, session: requests.Session,
-                           seen_ids: set[int]) -> list[tuple[str, str, str, str, str]]:
+async def crawl_category_via_api(category_name: str, category_id: int, client: httpx.AsyncClient,
+                                 sem: asyncio.Semaphore, seen_ids: set[int],
+                                 prev_done: asyncio.Event | None, done: asyncio.Event,
+                                 cache: ResponseCache | None = None) -> list[tuple[str, str, str, str, str]]:
     """
-    ดึงเกมตามหมวดด้วย API + regex parser
+    ดึงเกมตามหมวดด้วย API (JSON)
     คืน list ของ (category, name, year, url, image_url)
+    - ยิงทุกหน้า (MAX_PAGES_PER_CAT) พร้อมกัน แล้วไล่ผลตามลำดับหน้า
     - กรอง expansion ออก
     - กันซ้ำโดยดูจาก game id (ข้ามหมวด/หลายหน้า)
+    - รอ prev_done (หมวดก่อนหน้าคัดเสร็จ) ก่อนแตะ seen_ids แล้ว set done ให้หมวดถัดไป
     """
-    rows = []
-    upgraded = 0
-
-    for page in range(1, MAX_PAGES_PER_CAT + 1):
-        print(f"[{category_name}] API page {page}")
-        items = api_fetch_page(session, objectid=category_id, pageid=page, showcount=SHOWCOUNT)
-        if not items:
-            print("  (empty) stop.")
-            break
-        
-        # print(f"  Fetched {len(items)} items from API")
-        # print(items)
-
-        for it in items:
-            # ข้าม expansions
-            if is_expansion(it):
-                continue
+    try:
+        print(f"[{category_name}] API pages 1..{MAX_PAGES_PER_CAT}")
+        pages = await asyncio.gather(*[
+            api_fetch_page(client, sem, objectid=category_id, pageid=page, showcount=SHOWCOUNT, cache=cache)
+            for page in range(1, MAX_PAGES_PER_CAT + 1)
+        ])
+
+        # คัดเกมตามลำดับหมวด: หมวดที่มาก่อนได้เกมซ้ำไปก่อน เหมือนตอนไล่ทีละหมวด
+        if prev_done is not None:
+            await prev_done.wait()
+
+        picked = []
+        for page, items in enumerate(pages, 1):
+            if not items:
+                print(f"[{category_name}] API page {page} (empty) stop.")
+                break
 
-            gid = get_game_id(it)
-            if not gid:
-                # ไม่มี id เชื่อถือได้ ข้ามเพื่อตัดปัญหาซ้ำ
-                continue
-            if gid in seen_ids:
-                # เคยเก็บไปแล้วจากหมวดก่อนหน้า/หน้าก่อนหน้า
-                continue
+            for it in items:
+                # ข้าม expansions
+                if is_expansion(it):
+                    continue
 
-            name = (it.get("name") or it.get("objectname") or "").strip()
-            year = parse_year(it)
-            if not name or not year:
-                continue  # ต้องการให้เก็บแม้ไม่มีปี ให้ผ่อนกฎตรงนี้
+                gid = get_game_id(it)
+                if not gid:
+                    # ไม่มี id เชื่อถือได้ ข้ามเพื่อตัดปัญหาซ้ำ
+                    continue
+                if gid in seen_ids:
+                    # เคยเก็บไปแล้วจากหมวดก่อนหน้า/หน้าก่อนหน้า
+                    continue
 
-            url = item_url(it)
-            img = pick_image_from_item(it)
+                name = (it.get("name") or it.get("objectname") or "").strip()
+                year = parse_year(it)
+                if not name or not year:
+                    continue  # ต้องการให้เก็บแม้ไม่มีปี ให้ผ่อนกฎตรงนี้
 
-            final_img = img
-            if UPGRADE_IMAGES and upgraded < MAX_UPGRADE_PER_CAT and url:
-                hi = fetch_detail_image_http(url, session)
-                if hi:
-                    final_img = hi
-                upgraded += 1
-                time.sleep(random.uniform(*UPGRADE_DELAY_RANGE))
+                picked.append((name, year, item_url(it), pick_image_from_item(it)))
+                seen_ids.add(gid)  # กันซ้ำด้วย id ที่ระดับ global
 
-            rows.append((category_name, name, year, url, final_img))
-            seen_ids.add(gid)  # กันซ้ำด้วย id ที่ระดับ global
+                if len(picked) >= TARGET_PER_CAT:
+                    break
 
-            if len(rows) >= TARGET_PER_CAT:
+            if len(picked) >= TARGET_PER_CAT:
                 break
+    finally:
+        done.set()
 
-        time.sleep(random.uniform(*API_DELAY_RANGE))
-        if len(rows) >= TARGET_PER_CAT:
-            break
+    # อัปเกรดรูปของทั้งหมวดพร้อมกัน (จำกัดด้วย semaphore)
+    if UPGRADE_IMAGES:
+        n_up = min(len(picked), MAX_UPGRADE_PER_CAT)
+        his = await asyncio.gather(*[
+            fetch_detail_image_http(url, client, sem) for _, _, url, _ in picked[:n_up]
+        ])
+        picked[:n_up] = [(name, year, url, hi or img)
+                         for (name, year, url, img), hi in zip(picked, his)]
 
-    return rows
+    return [(category_name, *p) for p in picked]
 
 # ----------------------------
-# Main
+# Output
 # ----------------------------
-def main():
-    s = requests.Session()
-
-    print("Fetching categories index ...")
-    categories = extract_categories_from_index(s)
-    print(f"Found categories: {len(categories)}")
-
-    cats_window = categories[START_CATEGORY:END_CATEGORY]
-    print(f"Category window: [{START_CATEGORY}:{END_CATEGORY}] -> {len(cats_window)} items")
-
-    all_rows = []
-    seen_ids: set[int] = set()  # กันซ้ำข้ามหมวด/หน้า
-
-    for cat_name, cat_url in cats_window:
-        cat_id = extract_category_id(cat_url)
-        if not cat_id:
-            print(f"Skip (cannot find id): {cat_name} -> {cat_url}")
-            continue
+class ParquetSink:
+    """
+    เขียนผลเป็น Parquet (เก็บแบบคอลัมน์ + zstd) ทีละหมวดเป็น row group
+    import pyarrow ตอนเปิดใช้เท่านั้น
+    """
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ("category", pa.string()),
+            ("name", pa.string()),
+            ("year", pa.int32()),
+            ("url", pa.string()),
+            ("image_url", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, rows: list[tuple[str, str, str, str, str]]):
+        if not rows:
+            return
+        cats, names, years, urls, imgs = zip(*rows)
+        years = [int(y) if y.lstrip("-").isdigit() else None for y in years]
+        self._writer.write_table(self._pa.table(
+            dict(zip(OUT_COLUMNS, (cats, names, years, urls, imgs))), schema=self._schema
+        ))
+
+    def close(self):
+        self._writer.close()
 
-        rows = crawl_category_via_api(cat_name, cat_id, s, seen_ids)
-        all_rows.extend(rows)
+# ----------------------------
+# Main
+# ----------------------------
+async def main():
+    sem = asyncio.Semaphore(HTTP_CONCURRENCY)
+    limits = httpx.Limits(max_connections=HTTP_CONCURRENCY, max_keepalive_connections=HTTP_KEEPALIVE)
+    cache = ResponseCache(API_CACHE_PATH, API_CACHE_TTL) if API_CACHE_PATH else None
+    parquet = ParquetSink(OUTFILE_PARQUET) if OUTFILE_PARQUET else None
 
-    with open(OUTFILE, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["category", "name", "year", "url", "image_url"])
-        w.writerows(all_rows)
+    try:
+        # client เดียวใช้ร่วมกันทั้ง api.geekdo.com และ boardgamegeek.com
+        # HTTP/2: หลาย request วิ่งเป็น stream บน TLS connection เดียว ไม่ต้อง handshake ใหม่
+        # httpx ไม่ตาม redirect เองเหมือน requests ต้องเปิด follow_redirects ไม่งั้น 3xx จะกลายเป็น error
+        async with httpx.AsyncClient(
+            http2=True, limits=limits, headers=HTTP_HEADERS, follow_redirects=True
+        ) as client:
+            print("Fetching categories index ...")
+            categories = await extract_categories_from_index(client)
+            print(f"Found categories: {len(categories)}")
+
+            cats_window = categories[START_CATEGORY:END_CATEGORY]
+            print(f"Category window: [{START_CATEGORY}:{END_CATEGORY}] -> {len(cats_window)} items")
+
+            jobs = []
+            for cat_name, cat_url in cats_window:
+                cat_id = extract_category_id(cat_url)
+                if not cat_id:
+                    print(f"Skip (cannot find id): {cat_name} -> {cat_url}")
+                    continue
+                jobs.append((cat_name, cat_id))
+
+            seen_ids: set[int] = set()  # กันซ้ำข้ามหมวด/หน้า
+            turns = [asyncio.Event() for _ in jobs]
+            tasks = [
+                asyncio.create_task(crawl_category_via_api(cat_name, cat_id, client, sem, seen_ids,
+                                                           turns[i - 1] if i else None, turns[i], cache=cache))
+                for i, (cat_name, cat_id) in enumerate(jobs)
+            ]
+
+            # เขียน CSV ทีละหมวดตามลำดับทันทีที่หมวดนั้นเสร็จ (ไม่กองทั้งหมดไว้ในหน่วยความจำ/ไม่เสียงานถ้าพังกลางทาง)
+            total = 0
+            with open(OUTFILE, "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow(OUT_COLUMNS)
+                for task in tasks:
+                    rows = await task
+                    w.writerows(rows)
+                    f.flush()
+                    if parquet is not None:
+                        parquet.write(rows)
+                    total += len(rows)
+    finally:
+        # ปิด parquet เสมอ ไม่งั้นไฟล์ไม่มี footer อ่านไม่ได้ (CSV flush ทีละหมวดอยู่แล้ว)
+        if parquet is not None:
+            parquet.close()
+        if cache is not None:
+            cache.close()
 
     print(f"Saved -> {OUTFILE}")
-    print("Total rows:", len(all_rows))
+    if parquet is not None:
+        print(f"Saved -> {OUTFILE_PARQUET}")
+    print("Total rows:", total)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
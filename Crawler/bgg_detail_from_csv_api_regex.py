@@ -2,39 +2,143 @@
 """
 อ่าน CSV ที่มีคอลัมน์ 'url' (ไปหน้าเกมบน BGG)
 จากนั้น:
-- แงะ gid จาก url (ด้วย regex)
-- เรียก XML API: /xmlapi2/thing?id=<gid>&stats=1
-- ใช้ "regex" ล้วน แกะค่าออกมาจาก XML (ไม่ใช้ xml.etree/json เลย)
+- แงะ gid จาก url (ไม่เจอค่อยหาใน HTML ด้วย regex)
+- เรียก XML API: /xmlapi2/thing?id=<gid>,<gid>,...&stats=1 (รวมทีละ XML_BATCH_SIZE เกม)
+- ใช้ "regex" ล้วน แกะค่าออกมาจาก XML บน bytes (ไม่ใช้ xml.etree, decode เฉพาะค่าที่จับได้)
 - เก็บ: title, players_min/max, time_min/max, age_plus, weight_5,
         description, alternate_names, designers, artists, publishers
 - รูปจากหน้าเกม: og_image, primary_image (regex จาก HTML)
-- รูปจากหน้า Gallery (optional): regex จาก HTML
+- รูปจากหน้า Gallery (optional): JSON จาก images API (regex สำรอง) ไม่เจอค่อย regex จาก HTML
+- ทำหลายแถวพร้อมกันด้วย asyncio + httpx.AsyncClient แบบ HTTP/2 (จำกัดด้วย ROW_CONCURRENCY)
 
-หมายเหตุ: ยังกัน rate-limit (sleep แบบสุ่ม) และมี backoff เบื้องต้น
+หมายเหตุ: คุมความเร็วด้วย token bucket ต่อ host (อ่าน Retry-After / X-RateLimit-* จาก response)
+และ backoff แบบ exponential เมื่อโดน 429/503
 """
 
+import os
 import csv
 import re
-import time
+import json
 import html
 import random
-import requests
-from urllib.parse import urljoin
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import contextlib
+import httpx
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+# ตัวไล่ข้อความยาว ๆ (หน้า gallery / XML) ใช้ RE2 ถ้ามี: เวลาเชิงเส้น ไม่ backtrack
+# pattern กลุ่มนี้ใส่ flag แบบ inline (?i) เพื่อให้ใช้ได้ทั้ง re2 และ re
+# (เป็น bytes pattern ไล่บน body ดิบ ๆ: \s \d \b เป็น ASCII ในตัว)
+try:
+    import re2 as _re
+except ImportError:
+    _re = re
+
+# JSON ของ gallery API: ใช้ orjson ถ้ามี (เร็วกว่า) ไม่มีก็ json ปกติ
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# ล้าง tag/entity ของคำอธิบายด้วย lxml (C, รอบเดียว) ถ้ามี ไม่มีก็ใช้ regex + html.unescape
+try:
+    from lxml import html as lhtml
+    from lxml.etree import LxmlError
+except ImportError:
+    lhtml = None
 
 # --------------- Config ----------------
 # INPUT_CSV = "boardgame_categories_with_images_by_api2.csv"
 INPUT_CSV = "boardgame_categories_with_images_by_api_regex.csv"
 OUTPUT_CSV = "bgg_details_from_urls_api_regex.csv"
+# ถ้ามี OUTPUT_CSV จากรอบก่อนอยู่แล้ว: ข้าม url ที่ทำไปแล้ว และเขียนต่อท้ายไฟล์เดิม
+RESUME = True
+# คอลัมน์ของไฟล์ผลลัพธ์ (ลำดับเดียวกับ tuple ที่ to_row คืน)
+OUT_COLUMNS = (
+    "url",
+    "title",
+    "players_min",
+    "players_max",
+    "time_min",
+    "time_max",
+    "age_plus",
+    "weight_5",
+    "average_rating",
+    "description",
+    "og_image",
+    "primary_image",
+    "gallery_images",
+    "alternate_names",
+    "designers",
+    "artists",
+    "publishers",
+)
 SITE_ROOT = "https://boardgamegeek.com"
 
 FETCH_GALLERY = True
 MAX_GALLERY_IMAGES = 12
-GALLERY_DELAY_RANGE = (0.35, 0.8)
-PAGE_DELAY_RANGE = (0.25, 0.6)
+
+# อัตรายิงต่อ host (request/วินาที) — แต่ละ host มี bucket ของตัวเอง
+HOST_RATES = {
+    "boardgamegeek.com": 4,
+    "api.geekdo.com": 4,
+}
+
+# จำนวนแถวที่ทำพร้อมกัน และจำนวน connection สูงสุดของ client
+ROW_CONCURRENCY = 32
+HTTP_MAX_CONNECTIONS = 64
+# XML thing API รับได้หลาย id ต่อครั้ง (?id=1,2,3) — รวมทีละกี่ id
+XML_BATCH_SIZE = 20
+# จำนวน process ที่ช่วย parse HTML/XML — 0 = parse ใน event loop เลย (ค่าเริ่มต้น:
+# regex ของหน้าเกมถูกกว่าการ pickle HTML หลายร้อย KB ไปกลับ process อื่น เปิดเมื่อวัดแล้วคุ้มเท่านั้น)
+PARSE_WORKERS = 0
+# เขียนผลลงไฟล์ทีละแถวระหว่างรัน แล้ว flush ทุก ๆ กี่แถว (กันงานหายถ้าโปรแกรมตายกลางทาง)
+FLUSH_EVERY = 50
+HTTP_KEEPALIVE = 32
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0"}
+# ปิด Nagle: request/response เล็ก ๆ (XML API) ไม่ต้องรอ delayed ACK ~40ms
+HTTP_SOCKET_OPTIONS = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
+
+# จำนวน request ที่ค้างอยู่พร้อมกัน: รวมทั้งหมด / ต่อ host / เฉพาะ gallery (ให้ gallery ไม่แย่งช่องของหน้าเกม+XML)
+HTTP_CONCURRENCY = 32
+HOST_CONCURRENCY = 8
+GALLERY_CONCURRENCY = 4
+# retry: status ที่ควรลองใหม่ / จำนวนครั้ง / backoff = BACKOFF_FACTOR * 2**attempt + สุ่ม 0..BACKOFF_JITTER
+# (ถ้า server ส่ง Retry-After มาใช้ค่านั้นแทน) status error อื่น เช่น 404 ไม่ลองใหม่
+RETRY_STATUSES = frozenset((429, 502, 503, 504))
+MAX_RETRY = 6
+BACKOFF_FACTOR = 1.0
+BACKOFF_JITTER = 0.5
+# request ที่ใช้เวลานานกว่านี้ (วินาที) จะถูก log ไว้ดูตอนจูนค่าด้านบน
+SLOW_REQUEST_SECS = 5.0
+
+# หน้า gallery อ่านแบบ stream ทีละ chunk แล้วไล่ regex ไปเรื่อย ๆ (ได้รูปครบก็ตัดทิ้งที่เหลือ)
+# STREAM_OVERLAP = จำนวนตัวอักษรท้าย buffer ที่เก็บไว้กัน match คร่อมรอยต่อ chunk
+STREAM_CHUNK = 64 * 1024
+STREAM_OVERLAP = 4096
+
+# แคช response ลงดิสก์ (None = ไม่ใช้) รันซ้ำแล้วหน้าที่ยังไม่หมดอายุไม่ต้องยิง network
+# อายุแคช (วินาที) ตามชนิด URL: ใช้รายการแรกที่ข้อความตรงกับ URL
+HTTP_CACHE_PATH = "bgg_detail_cache.sqlite"
+HTTP_CACHE_TTLS = [
+    ("/xmlapi2/thing", 24 * 3600),
+    ("api.geekdo.com/api/images", 6 * 3600),
+    ("", 12 * 3600),  # หน้า HTML อื่น ๆ
+]
 
 # --------------- Regex -----------------
 # จากหน้าเกม (HTML) สำหรับรูป/title เฉพาะ
-ID_RE = re.compile(r"/boardgame(?:expansion)?/(\d+)")
+# ใช้หา gid ใน HTML (ไม่รู้ตำแหน่ง) เท่านั้น; ใน url ใช้ extract_gid
+ID_RE = re.compile(rb"/boardgame(?:expansion)?/(\d+)")
 OG_IMG_RE = re.compile(
     r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', re.I
 )
@@ -48,82 +152,328 @@ DESC_BLOCK_RE = re.compile(
 META_DESC_RE = re.compile(
     r'<meta\s+name=["\']description["\']\s+content=["\']([^"\']+)["\']', re.I
 )
-IMG_TAG_RE = re.compile(r'<img[^>]+src=["\']([^"\']+)["\']', re.I)
+IMG_TAG_RE = _re.compile(rb'(?i)<img[^>]+src=["\']([^"\']+)["\']')
 TAG_RE = re.compile(r"<[^>]+>")
 WS_RE = re.compile(r"\s+")
 
-# จาก XML API (regex ล้วน)
-# ชื่อหลักและชื่อรอง
-PRIMARY_NAME_RE = re.compile(
-    r"<name[^>]*\stype=['\"]primary['\"][^>]*\svalue=['\"](.*?)['\"][^>]*/?>",
-    re.I | re.S,
-)
-ALT_NAME_RE = re.compile(
-    r"<name[^>]*\stype=['\"]alternate['\"][^>]*\svalue=['\"](.*?)['\"][^>]*/?>",
-    re.I | re.S,
-)
-# ค่าตัวเลข/ตัวชี้วัด
-ATTR_VAL_RE = lambda tag: re.compile(
-    rf"<{tag}[^>]*\svalue=['\"](\d+)['\"][^>]*/?>", re.I
+# จาก XML API (regex ล้วน, ไล่บน bytes แล้ว decode เฉพาะค่าที่จับได้)
+# ชื่อหลักและชื่อรอง ในการไล่ครั้งเดียว (group 1 = primary/alternate, group 2 = ชื่อ)
+NAME_RE = _re.compile(
+    rb"(?i)<name[^>]*\stype=['\"](primary|alternate)['\"][^>]*\svalue=['\"](.*?)['\"][^>]*/?>"
 )
-MINPLAY_RE = ATTR_VAL_RE("minplaytime")
-MAXPLAY_RE = ATTR_VAL_RE("maxplaytime")
-MINPLAYERS_RE = ATTR_VAL_RE("minplayers")
-MAXPLAYERS_RE = ATTR_VAL_RE("maxplayers")
-MINAGE_RE = ATTR_VAL_RE("minage")
-WEIGHT_RE_XML = re.compile(
-    r"<averageweight[^>]*\svalue=['\"]([0-9.]+)['\"][^>]*/?>", re.I
-)
-
-AVERAGE_RATING_RE = re.compile(
-    r"<average[^>]*\svalue=['\"]([0-9.]+)['\"][^>]*/?>", re.I
+# ค่าตัวเลข/ตัวชี้วัด ทุกแท็กในการไล่ครั้งเดียว (group 1 = แท็ก, group 2 = ค่า)
+# \b กันไม่ให้ <average ไปจับ <averageweight
+COMBINED_RE = _re.compile(
+    rb"(?i)<(minplayers|maxplayers|minplaytime|maxplaytime|minage|averageweight|average)\b"
+    rb"[^>]*\svalue=['\"]([^'\"]+)['\"]"
 )
 
+# ตัด XML ที่มีหลาย <item> ออกเป็นก้อนละเกม แล้วอ่าน id ของแต่ละก้อน
+ITEM_SPLIT_RE = re.compile(rb"(?=<item\s)")
+ITEM_ID_RE = re.compile(rb"<item\s[^>]*\bid=['\"](\d+)['\"]")
 # คำอธิบาย (อาจมี \n และ entities)
-DESC_XML_RE = re.compile(r"<description>([\s\S]*?)</description>", re.I)
+DESC_XML_RE = _re.compile(rb"(?is)<description>(.*?)</description>")
 # ลิงก์เครดิต
-LINK_RE = re.compile(
-    r"<link[^>]*\stype=['\"](boardgamedesigner|boardgameartist|boardgamepublisher)['\"][^>]*\svalue=['\"](.*?)['\"][^>]*/?>",
-    re.I,
+LINK_RE = _re.compile(
+    rb"(?i)<link[^>]*\stype=['\"](boardgamedesigner|boardgameartist|boardgamepublisher)['\"][^>]*\svalue=['\"](.*?)['\"][^>]*/?>"
 )
 
 
 def clean_html_text(s: str) -> str:
     if not s:
         return ""
+    if lhtml is not None:
+        try:
+            # ต่อข้อความแต่ละ node ด้วยช่องว่าง ให้ได้ผลเหมือนแทน tag ด้วย " "
+            t = " ".join(lhtml.fragment_fromstring(s, create_parent="div").itertext())
+            return WS_RE.sub(" ", t).strip()
+        except (ValueError, LxmlError):
+            pass
     s = html.unescape(TAG_RE.sub(" ", s))
     return WS_RE.sub(" ", s).strip()
 
 
+def extract_gid(url: str) -> str | None:
+    """แงะ gid จาก url แบบ .../boardgame/<gid>/... หรือ .../boardgameexpansion/<gid>/... (ไม่ใช้ regex)"""
+    for prefix in ("/boardgame/", "/boardgameexpansion/"):
+        i = url.find(prefix)
+        if i < 0:
+            continue
+        start = end = i + len(prefix)
+        while end < len(url) and "0" <= url[end] <= "9":
+            end += 1
+        return url[start:end] or None
+    return None
+
+
+@lru_cache(maxsize=4096)
 def to_abs(url: str) -> str:
     if not url:
         return ""
+    # ส่วนใหญ่เป็น URL เต็มอยู่แล้ว
+    if url.startswith(("https://", "http://")):
+        return url
     if url.startswith("//"):
         return "https:" + url
     if url.startswith("/"):
-        return urljoin(SITE_ROOT, url)
+        return SITE_ROOT + url
     return url
 
 
+# --------------- Rate limit ------------
+def header_seconds(v: str | None) -> float | None:
+    """แปลงค่า Retry-After / X-RateLimit-Reset เป็นจำนวนวินาทีที่ต้องรอ (วินาที, epoch หรือ HTTP-date)"""
+    if not v:
+        return None
+    try:
+        sec = float(v)
+    except ValueError:
+        try:
+            sec = parsedate_to_datetime(v).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    else:
+        if sec > 1e9:  # เป็น epoch timestamp
+            sec -= time.time()
+    return max(sec, 0.0)
+
+
+class HostLimiter:
+    """
+    token bucket ของ host เดียว: เติม refill_rate token/วินาที สะสมได้ไม่เกิน capacity
+    ถ้า server บอกให้รอ (Retry-After / X-RateLimit-Remaining=0) ทุก request ของ host นั้นจะหยุดรอด้วยกัน
+    """
+
+    def __init__(self, refill_rate: float, capacity: float | None = None):
+        self.refill_rate = refill_rate
+        self.capacity = capacity or refill_rate
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate
+                )
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+
+    def observe(self, r: httpx.Response) -> float | None:
+        """อ่าน header จำกัดอัตราจาก response คืนจำนวนวินาทีที่ server ขอให้รอ (ถ้ามี)"""
+        wait = header_seconds(r.headers.get("Retry-After"))
+        if wait is None and r.headers.get("X-RateLimit-Remaining", "").strip() == "0":
+            wait = header_seconds(r.headers.get("X-RateLimit-Reset")) or 1.0
+        if wait:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+        return wait
+
+
+HOST_LIMITERS = {host: HostLimiter(rate) for host, rate in HOST_RATES.items()}
+HOST_SEMAPHORES = {host: asyncio.Semaphore(HOST_CONCURRENCY) for host in HOST_RATES}
+HTTP_SEM = asyncio.Semaphore(HTTP_CONCURRENCY)
+GALLERY_SEM = asyncio.Semaphore(GALLERY_CONCURRENCY)
+
+
+# --------------- Cache -----------------
+class HttpCache:
+    """
+    แคช body ของ response ลง sqlite คีย์ด้วย URL เต็ม พร้อม ETag / Last-Modified
+    หมดอายุตาม HTTP_CACHE_TTLS แล้วยังเอา validator ไปถาม server ได้ (304 → ใช้ body เดิม)
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses"
+            " (url TEXT PRIMARY KEY, fetched_at REAL, etag TEXT, last_modified TEXT, body BLOB)"
+        )
+
+    @staticmethod
+    def ttl_for(url: str) -> float:
+        for pat, ttl in HTTP_CACHE_TTLS:
+            if pat in url:
+                return ttl
+        return 0
+
+    def get(self, url: str) -> tuple[bytes, bool, dict] | None:
+        """คืน (body, ยังไม่หมดอายุไหม, header สำหรับ conditional request) หรือ None ถ้าไม่มีในแคช"""
+        row = self._db.execute(
+            "SELECT fetched_at, etag, last_modified, body FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        if not row:
+            return None
+        fetched_at, etag, last_modified, body = row
+        cond = {}
+        if etag:
+            cond["If-None-Match"] = etag
+        if last_modified:
+            cond["If-Modified-Since"] = last_modified
+        return body, time.time() - fetched_at < self.ttl_for(url), cond
+
+    def is_fresh(self, url: str) -> bool:
+        row = self._db.execute("SELECT fetched_at FROM responses WHERE url = ?", (url,)).fetchone()
+        return bool(row) and time.time() - row[0] < self.ttl_for(url)
+
+    def put(self, url: str, body: bytes, etag: str | None = None, last_modified: str | None = None):
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (url, time.time(), etag, last_modified, body),
+            )
+
+    def touch(self, url: str):
+        """server ตอบ 304: body เดิมยังใช้ได้ ต่ออายุใหม่"""
+        with self._db:
+            self._db.execute("UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def close(self):
+        self._db.close()
+
+
+# แคชของรอบนี้ (เปิดใน main ถ้าตั้ง HTTP_CACHE_PATH)
+http_cache: HttpCache | None = None
+
+
 # --------------- HTTP helper -----------
-def http_get_text(
-    session: requests.Session, url: str, *, timeout=25, max_retry=6
-) -> str:
+def backoff_seconds(attempt: int, retry_after: float | None = None) -> float:
+    """เวลารอก่อนลองครั้งถัดไป: Retry-After ของ server ก่อน ไม่มีก็ exponential + jitter"""
+    if retry_after:
+        return retry_after
+    return BACKOFF_FACTOR * 2**attempt + random.uniform(0, BACKOFF_JITTER)
+
+
+async def fetch_bytes(
+    client: httpx.AsyncClient,
+    url: str,
+    *,
+    sem: asyncio.Semaphore | None = None,
+    timeout=25,
+    max_retry=MAX_RETRY,
+    cache=True,
+) -> bytes:
+    """
+    GET แล้วคืน body ดิบ (ล้มเหลว → b"") — XML/JSON ไล่ regex/parse บน bytes ได้เลย ไม่ต้อง decode ทั้งก้อน
+    เจอในแคชและยังไม่หมดอายุ → คืนเลย ไม่ผ่าน limiter/semaphore (cache=False: ไม่อ่าน/ไม่เก็บแคชของ url นี้)
+    ช่องที่ต้องถือระหว่างยิง: sem ของกลุ่มงาน (ถ้ามี) → ต่อ host → รวมทั้งหมด
+    ช่วง backoff ไม่ถือช่องไว้ เพื่อไม่ให้ request ที่ช้า/โดน 429 ไปกั้น request อื่น
+    """
+    cache = cache and http_cache is not None
+    cached = http_cache.get(url) if cache else None
+    if cached and cached[1]:
+        return cached[0]
+    cond = cached[2] if cached else {}
+
+    host = urlsplit(url).hostname
+    limiter = HOST_LIMITERS.get(host)
+    host_sem = HOST_SEMAPHORES.get(host)
+    rid = uuid.uuid4().hex[:8]
     for attempt in range(max_retry):
         try:
-            r = session.get(url, timeout=timeout, headers={"User-Agent": "Mozilla/5.0"})
-            if r.status_code in (429, 502, 503, 504):
-                wait = (attempt + 1) * 2 + random.random()
-                print(f"  HTTP {r.status_code} -> backoff {wait:.1f}s ({url})")
-                time.sleep(wait)
+            if limiter:
+                await limiter.acquire()
+            async with sem or contextlib.nullcontext(), host_sem or contextlib.nullcontext(), HTTP_SEM:
+                t0 = time.monotonic()
+                # stream: เช็ค status ก่อน ถ้าโดน 429/5xx ก็ไม่ต้องโหลด body ทิ้ง
+                async with client.stream("GET", url, timeout=timeout, headers=cond) as r:
+                    if r.is_success:
+                        await r.aread()
+                elapsed = time.monotonic() - t0
+            if elapsed > SLOW_REQUEST_SECS:
+                print(f"  slow [{rid}] {elapsed:.1f}s HTTP {r.status_code} ({url})")
+            retry_after = limiter.observe(r) if limiter else header_seconds(r.headers.get("Retry-After"))
+            if r.status_code in RETRY_STATUSES:
+                wait = backoff_seconds(attempt, retry_after)
+                print(f"  [{rid}] HTTP {r.status_code} -> backoff {wait:.1f}s ({url})")
+                await asyncio.sleep(wait)
                 continue
-            r.raise_for_status()
-            return r.text
-        except Exception as e:
-            wait = (attempt + 1) * 1.2 + random.random()
-            print(f"  HTTP error: {e} -> retry in {wait:.1f}s ({url})")
-            time.sleep(wait)
-    return ""
+            if r.status_code == 304 and cached:
+                http_cache.touch(url)
+                return cached[0]
+            if not r.is_success:
+                print(f"  [{rid}] HTTP {r.status_code} -> give up ({url})")
+                return b""
+            if cache and r.content:
+                http_cache.put(url, r.content, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+            return r.content
+        except httpx.HTTPError as e:
+            wait = backoff_seconds(attempt)
+            print(f"  [{rid}] HTTP error: {e!r} -> retry in {wait:.1f}s ({url})")
+            await asyncio.sleep(wait)
+    return b""
+
+
+async def iter_bytes(
+    client: httpx.AsyncClient,
+    url: str,
+    *,
+    sem: asyncio.Semaphore | None = None,
+    timeout=25,
+    max_retry=MAX_RETRY,
+):
+    """
+    เหมือน fetch_bytes แต่ yield body ทีละ chunk (ล้มเหลว → ไม่ yield อะไรเลย)
+    retry ได้เฉพาะก่อนเริ่มส่ง chunk แรก; ผู้เรียกควรครอบด้วย contextlib.aclosing
+    เพื่อให้ break กลางทางแล้วปิด response/คืนช่อง semaphore ทันที
+    """
+    host = urlsplit(url).hostname
+    limiter = HOST_LIMITERS.get(host)
+    host_sem = HOST_SEMAPHORES.get(host)
+    rid = uuid.uuid4().hex[:8]
+    for attempt in range(max_retry):
+        started = False
+        try:
+            if limiter:
+                await limiter.acquire()
+            async with sem or contextlib.nullcontext(), host_sem or contextlib.nullcontext(), HTTP_SEM:
+                t0 = time.monotonic()
+                async with client.stream("GET", url, timeout=timeout) as r:
+                    elapsed = time.monotonic() - t0
+                    if elapsed > SLOW_REQUEST_SECS:
+                        print(f"  slow [{rid}] {elapsed:.1f}s HTTP {r.status_code} ({url})")
+                    retry_after = limiter.observe(r) if limiter else header_seconds(r.headers.get("Retry-After"))
+                    if r.status_code not in RETRY_STATUSES:
+                        if not r.is_success:
+                            print(f"  [{rid}] HTTP {r.status_code} -> give up ({url})")
+                            return
+                        started = True
+                        async for chunk in r.aiter_bytes(STREAM_CHUNK):
+                            yield chunk
+                        return
+            wait = backoff_seconds(attempt, retry_after)
+            print(f"  [{rid}] HTTP {r.status_code} -> backoff {wait:.1f}s ({url})")
+            await asyncio.sleep(wait)
+        except httpx.HTTPError as e:
+            if started:
+                print(f"  [{rid}] HTTP error mid-stream: {e!r} ({url})")
+                return
+            wait = backoff_seconds(attempt)
+            print(f"  [{rid}] HTTP error: {e!r} -> retry in {wait:.1f}s ({url})")
+            await asyncio.sleep(wait)
+
+
+async def scan_stream(chunks, pattern):
+    """
+    ไล่ pattern.finditer บน stream ของ bytes แล้ว yield match ที่ครบแล้ว
+    เก็บไว้แค่หางของ buffer (หลัง match สุดท้าย หรือ STREAM_OVERLAP ตัวท้าย) ไม่ต้องถือทั้ง body
+    """
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        end = 0
+        for m in pattern.finditer(buf):
+            yield m
+            end = m.end()
+        buf = buf[max(end, len(buf) - STREAM_OVERLAP):]
 
 
 # --------------- Parsers (HTML) --------
@@ -157,64 +507,56 @@ def parse_description_from_html(html_src: str) -> str:
 
 
 # --------------- Parsers (XML via regex) ----------
-def parse_detail_from_xml_text(xml_txt: str) -> dict:
-    """ดึงข้อมูลจาก XML string โดย regex ล้วน"""
+def parse_detail_from_xml_text(xml_txt: bytes) -> dict:
+    """ดึงข้อมูลจาก XML (bytes) โดย regex ล้วน decode เฉพาะค่าที่จับได้"""
     # title
 
     # print(xml_txt)
-    m = PRIMARY_NAME_RE.search(xml_txt)
-    title = html.unescape(m.group(1)).strip() if m else ""
-
-    # alt names
-    alt_names = [html.unescape(x).strip() for x in ALT_NAME_RE.findall(xml_txt)]
-
-    # players/time/age
-    def grab(re_pat):
-        m = re_pat.search(xml_txt)
-        return m.group(1) if m else ""
-
-    pmin = grab(MINPLAYERS_RE)
-    pmax = grab(MAXPLAYERS_RE)
-    tmin = grab(MINPLAY_RE)
-    tmax = grab(MAXPLAY_RE)
-    age = grab(MINAGE_RE)
-    # weight
-    m = WEIGHT_RE_XML.search(xml_txt)
-    weight = m.group(1) if m else ""
-
-    # average rating (ถ้ามี)
-    m = AVERAGE_RATING_RE.search(xml_txt)
-    avg_rating = m.group(1) if m else ""
+    title = ""
+    alt_names = []
+    for t, v in NAME_RE.findall(xml_txt):
+        v = html.unescape(v.decode("utf-8", "replace")).strip()
+        if t.lower() == b"primary":
+            title = title or v
+        else:
+            alt_names.append(v)
+
+    # players/time/age/weight/average rating: เก็บค่าแรกที่เจอของแต่ละแท็ก
+    vals = {}
+    for t, v in COMBINED_RE.findall(xml_txt):
+        vals.setdefault(t.lower().decode("ascii"), v.decode("ascii", "replace"))
+
+    pmin = vals.get("minplayers", "")
+    pmax = vals.get("maxplayers", "")
+    tmin = vals.get("minplaytime", "")
+    tmax = vals.get("maxplaytime", "")
+    age = vals.get("minage", "")
+    weight = vals.get("averageweight", "")
+    avg_rating = vals.get("average", "")
 
     # description
     m = DESC_XML_RE.search(xml_txt)
     desc = ""
     if m:
         # XML description ใช้ entities; unescape แล้ว normalize space
-        desc = clean_html_text(m.group(1))
+        desc = clean_html_text(m.group(1).decode("utf-8", "replace"))
 
     # credits
     designers, artists, publishers = [], [], []
     for t, v in LINK_RE.findall(xml_txt):
-        v = html.unescape(v).strip()
+        v = html.unescape(v.decode("utf-8", "replace")).strip()
         if not v:
             continue
-        if t == "boardgamedesigner":
+        if t == b"boardgamedesigner":
             designers.append(v)
-        elif t == "boardgameartist":
+        elif t == b"boardgameartist":
             artists.append(v)
-        elif t == "boardgamepublisher":
+        elif t == b"boardgamepublisher":
             publishers.append(v)
 
     # de-dup รักษาลำดับ
     def uniq(xs):
-        seen = set()
-        out = []
-        for x in xs:
-            if x and x not in seen:
-                seen.add(x)
-                out.append(x)
-        return out
+        return list(dict.fromkeys(filter(None, xs)))
 
     return {
         "title": title,
@@ -234,31 +576,23 @@ def parse_detail_from_xml_text(xml_txt: str) -> dict:
 
 
 # --------------- Gallery ----------------
-def build_gallery_url(game_url: str):
-    m = ID_RE.search(game_url)
-    if not m:
-        return None
-    return f"{SITE_ROOT}/boardgame/{m.group(1)}/images"
+def build_gallery_url(gid: str) -> str:
+    return f"{SITE_ROOT}/boardgame/{gid}/images"
 
 
-def fetch_gallery_images_regex(session: requests.Session, detail_url: str, limit=12):
-    gu = build_gallery_url(detail_url)
-    if not gu:
-        return []
-    html_src = http_get_text(session, gu)
-    # print(html_src)
-    if not html_src:
-        return []
+async def fetch_gallery_images_regex(client: httpx.AsyncClient, gid: str, limit=12):
+    gu = build_gallery_url(gid)
     imgs = []
-    for m in IMG_TAG_RE.finditer(html_src):
-        src = m.group(1)
-        if "cf.geekdo-images.com" in src:
-            imgs.append(to_abs(src))
-            if len(imgs) >= limit:
-                break
+    async with contextlib.aclosing(iter_bytes(client, gu, sem=GALLERY_SEM)) as chunks:
+        async for m in scan_stream(chunks, IMG_TAG_RE):
+            src = m.group(1)
+            if b"cf.geekdo-images.com" in src:
+                imgs.append(to_abs(src.decode("utf-8", "replace")))
+                if len(imgs) >= limit:
+                    break
     return imgs
 
-# ---------------- Gallery via API (regex only) ----------------
+# ---------------- Gallery via API (JSON, regex สำรอง) ----------------
 # ตัวอย่าง API:
 # https://api.geekdo.com/api/images?ajax=1&foritempage=1&galleries[]=game&nosession=1&objectid=<gid>&objecttype=thing&showcount=24&size=large&sort=recent&pageid=1
 
@@ -269,59 +603,71 @@ IMAGES_URL_TMPL = (
     "&showcount={per_page}&size={size}&sort={sort}&pageid={page}"
 )
 
-# --- regex จับ url รูปจาก JSON (แบบไม่ใช้ json.loads) ---
-IMG_LG_RE    = re.compile(r'"imageurl_lg"\s*:\s*"([^"]+)"')
-IMG_2X_RE    = re.compile(r'"imageurl@2x"\s*:\s*"([^"]+)"')
-IMG_STD_RE   = re.compile(r'"imageurl"\s*:\s*"([^"]+)"')
-PAG_PER_RE   = re.compile(r'"perPage"\s*:\s*(\d+)')
-PAG_TOT_RE   = re.compile(r'"total"\s*:\s*(\d+)')
+# --- regex สำรอง เผื่อ JSON parse ไม่ผ่าน: จับ url รูป + pagination ---
+# ไล่ครั้งเดียว: group 1 = คีย์, group 2 = url (imageurl_lg / imageurl@2x / imageurl),
+# group 3 = ตัวเลข (perPage / total)
+GALLERY_KEY_RE = re.compile(
+    rb'"(imageurl_lg|imageurl@2x|imageurl|perPage|total)"\s*:\s*(?:"([^"]+)"|(\d+)(?=\D))'
+)
+IMG_KEY_ORDER = ("imageurl_lg", "imageurl@2x", "imageurl")
 # (ถ้าบาง response ไม่มี total ให้ fallback จาก len(images) ที่ดึงได้)
 
 def _json_unescape_url(u: str) -> str:
-    # แก้ \" \/ \u002F ฯลฯ แบบง่าย ๆ พอใช้กับ URL
+    # แก้ \" \/ \u002F ฯลฯ ด้วยตัว decode สตริง JSON (C) ในรอบเดียว
     u = (u or "").strip()
-    u = u.replace(r"\/", "/")
+    try:
+        u = json.loads('"' + u + '"')
+    except ValueError:
+        u = u.replace(r"\/", "/")
     return to_abs(u)
 
-def _prefer_urls_from_block(txt: str) -> list[str]:
-    """
-    รับ JSON text ทั้งก้อนของหน้านั้น แล้วดึง URL รูปตามลำดับความสำคัญ:
-    imageurl_lg > imageurl@2x > imageurl
-    """
+def _urls_from_images_json(data: dict) -> list[str]:
+    """ต่อรูปหนึ่งรูป เลือก imageurl_lg > imageurl@2x > imageurl"""
     urls = []
-
-    # 1) lg
-    for m in IMG_LG_RE.findall(txt):
-        urls.append(_json_unescape_url(m))
-
-    # 2) @2x (แต่บางทีซ้ำกับ lg ก็กรองตอนรวม)
-    for m in IMG_2X_RE.findall(txt):
-        urls.append(_json_unescape_url(m))
-
-    # 3) ปกติ
-    for m in IMG_STD_RE.findall(txt):
-        urls.append(_json_unescape_url(m))
-
-    # คงไว้เฉพาะโดเมนรูปจริง
-    urls = [u for u in urls if "cf.geekdo-images.com" in u]
+    for item in data.get("images") or []:
+        u = item.get("imageurl_lg") or item.get("imageurl@2x") or item.get("imageurl")
+        if u:
+            u = to_abs(u.strip())
+            # คงไว้เฉพาะโดเมนรูปจริง
+            if "cf.geekdo-images.com" in u:
+                urls.append(u)
     return urls
 
-def _extract_pagination(txt: str) -> tuple[int, int]:
+def _scan_images_text(txt: bytes) -> tuple[list[str], dict]:
     """
-    คืน (per_page, total_items) จากฟิลด์ pagination ใน JSON (regex)
-    ไม่ชัวร์ → ให้ค่า default ที่พอเดาได้
+    (สำรอง) ไล่ GALLERY_KEY_RE รอบเดียว ดึง URL รูปตามลำดับความสำคัญ imageurl_lg > imageurl@2x > imageurl
+    และ {"perPage"/"total": ค่าแรกที่เจอ}
     """
-    per_page = 24
-    total = 0
-    m = PAG_PER_RE.search(txt)
-    if m:
-        try: per_page = int(m.group(1))
-        except: pass
-    m = PAG_TOT_RE.search(txt)
-    if m:
-        try: total = int(m.group(1))
-        except: pass
-    return per_page, total
+    # แยกใส่ถังตามคีย์ (@2x บางทีซ้ำกับ lg ก็กรองตอนรวม)
+    buckets = {k: [] for k in IMG_KEY_ORDER}
+    pagination = {}
+    for k, u, n in GALLERY_KEY_RE.findall(txt):
+        k = k.decode("ascii")
+        if k in buckets:
+            if u:
+                buckets[k].append(_json_unescape_url(u.decode("utf-8", "replace")))
+        elif n:
+            pagination.setdefault(k, int(n))
+        elif u.isdigit():
+            # geekdo ส่งตัวเลขมาเป็น string บ่อย ๆ ("total": "5")
+            pagination.setdefault(k, int(u))
+
+    # ต่อกันตามลำดับความสำคัญ และคงไว้เฉพาะโดเมนรูปจริง
+    urls = [u for k in IMG_KEY_ORDER for u in buckets[k] if "cf.geekdo-images.com" in u]
+    return urls, pagination
+
+def _parse_images_page(txt: bytes) -> tuple[list[str], dict]:
+    """คืน (URL รูป, pagination) ของหน้านั้น: parse JSON ก่อน ไม่ผ่านค่อย regex"""
+    try:
+        data = _json_loads(txt)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return _scan_images_text(txt)
+    pagination = data.get("pagination")
+    if not isinstance(pagination, dict):
+        pagination = {}
+    return _urls_from_images_json(data), pagination
 
 def build_images_api_url(gid: str, page: int = 1, *,
                          per_page: int = 24,
@@ -332,17 +678,11 @@ def build_images_api_url(gid: str, page: int = 1, *,
         gid=gid, page=page, per_page=per_page, size=size, gallery=gallery, sort=sort
     )
 
-def fetch_gallery_images_via_api(session: requests.Session, detail_url: str,
-                                 limit: int = 12,
-                                 size: str = "large",
-                                 gallery: str = "game",
-                                 sort: str = "recent") -> list[str]:
-    # ใช้ regex เดิมของคุณเพื่อเอา gid ให้ได้ก่อน
-    m = ID_RE.search(detail_url)
-    if not m:
-        return []
-    gid = m.group(1)
-
+async def fetch_gallery_images_via_api(client: httpx.AsyncClient, gid: str,
+                                       limit: int = 12,
+                                       size: str = "large",
+                                       gallery: str = "game",
+                                       sort: str = "recent") -> list[str]:
     page = 1
     out, seen = [], set()
     per_page = 24
@@ -350,12 +690,12 @@ def fetch_gallery_images_via_api(session: requests.Session, detail_url: str,
 
     while len(out) < limit:
         api = build_images_api_url(gid, page, per_page=per_page, size=size, gallery=gallery, sort=sort)
-        txt = http_get_text(session, api)
-        if not txt:
-            break
 
         # ดึงรูป (ตามลำดับความสำคัญ lg > @2x > std)
-        urls = _prefer_urls_from_block(txt)
+        txt = await fetch_bytes(client, api, sem=GALLERY_SEM)
+        if not txt:
+            break
+        urls, pagination = _parse_images_page(txt)
         for u in urls:
             if u not in seen:
                 seen.add(u)
@@ -365,7 +705,11 @@ def fetch_gallery_images_via_api(session: requests.Session, detail_url: str,
 
         # อ่าน pagination เพื่อรู้ว่าจะไปต่อกี่หน้า
         if total is None:
-            per_page, total = _extract_pagination(txt)
+            try:
+                per_page = int(pagination.get("perPage") or 24)
+                total = int(pagination.get("total") or 0)
+            except (TypeError, ValueError):
+                per_page, total = 24, 0
             # ถ้า total ดันเป็น 0 ให้เดาจากจำนวนรูปในหน้านี้
             if total == 0:
                 total = len(urls)
@@ -380,135 +724,307 @@ def fetch_gallery_images_via_api(session: requests.Session, detail_url: str,
             break
 
         page += 1
-        # กัน rate-limit หน้า/หน้า
-        time.sleep(random.uniform(*GALLERY_DELAY_RANGE))
 
     return out[:limit]
 
 
 
-# --------------- Main -------------------
-def main():
-    s = requests.Session()
+# --------------- Row -------------------
+def build_thing_api_url(gid: str) -> str:
+    # gid เดียว หรือหลายตัวคั่นด้วย comma
+    return f"{SITE_ROOT}/xmlapi2/thing?id={gid}&stats=1"
 
-    with open(INPUT_CSV, "r", encoding="utf-8") as f:
-        in_rows = list(csv.DictReader(f))
 
-    out_rows = []
-    for i, row in enumerate(in_rows, 1):
-        url = (row.get("url") or "").strip()
-        if not url:
-            continue
-        url = to_abs(url)
-        print(f"[{i}/{len(in_rows)}] {url}")
+def split_thing_items(xml_txt: bytes) -> dict[str, bytes]:
+    """แยก XML ที่มีหลาย <item> เป็น {gid: XML ของเกมนั้น}"""
+    out = {}
+    for block in ITEM_SPLIT_RE.split(xml_txt)[1:]:
+        m = ITEM_ID_RE.match(block)
+        if m:
+            out[m.group(1).decode("ascii")] = block
+    return out
 
-        # 1) HTML หน้าเกม → ภาพ og/primary + title fallback + desc fallback
-        html_src = http_get_text(s, url)
-        if not html_src:
-            print("  skip (HTML fetch failed)")
-            continue
-        og_img, primary_img = parse_images_from_html(html_src)
-        title_fallback = parse_title_from_html(html_src)
-        desc_fallback = parse_description_from_html(html_src)
 
-        # 2) gid → XML API (แล้ว regex ล้วน)
-        m = ID_RE.search(url) or ID_RE.search(html_src)
-        if not m:
-            print("  skip (no gid)")
-            continue
-        gid = m.group(1)
-        api_url = f"{SITE_ROOT}/xmlapi2/thing?id={gid}&stats=1"
-        xml_txt = http_get_text(s, api_url)
-        if not xml_txt:
-            print("  warn: XML API not fetched, fallback to HTML-only values")
-            details = {
-                "title": title_fallback,
-                "players_min": "",
-                "players_max": "",
-                "time_min": "",
-                "time_max": "",
-                "age_plus": "",
-                "weight_5": "",
-                "description": desc_fallback,
-                "alternate_names": "",
-                "designers": "",
-                "artists": "",
-                "publishers": "",
-            }
-        else:
-            details = parse_detail_from_xml_text(xml_txt)
-            if not details.get("title"):
-                details["title"] = title_fallback
-            if not details.get("description"):
-                details["description"] = desc_fallback
+class ThingBatches:
+    """
+    รวม gid ของทุกแถว (ตามลำดับ input) เป็นชุดละ XML_BATCH_SIZE แล้วยิง XML API ชุดละครั้ง
+    แถวแรกที่ขอ gid ของชุดไหนจะเป็นคนยิง แถวอื่นในชุดเดียวกันรอผลเดียวกัน
+    ทุกแถวของชุดรับไปครบแล้วก็ทิ้งผลของชุดนั้น (ไม่ถือ XML ทั้งหมดไว้ใน memory)
+    แคช XML แยกรายเกม (คีย์ url แบบ id เดียว) ไม่ใช่ทั้งชุด: gid ที่ยังสดในแคชไม่ต้องเข้าชุด
+    รอบ resume ที่ชุดถูกแบ่งใหม่ก็ยังใช้แคชได้
+    """
 
-        # 3) Gallery (optional)
-        # gallery = []
-        # if FETCH_GALLERY:
-        #     gallery = fetch_gallery_images_regex(s, url, MAX_GALLERY_IMAGES)
-        #     time.sleep(random.uniform(*GALLERY_DELAY_RANGE))
+    def __init__(self, client: httpx.AsyncClient, gids: list[str]):
+        self._client = client
+        if http_cache is not None:
+            gids = [gid for gid in gids if not http_cache.is_fresh(build_thing_api_url(gid))]
+        uniq = list(dict.fromkeys(gids))
+        self._batches = [uniq[i:i + XML_BATCH_SIZE] for i in range(0, len(uniq), XML_BATCH_SIZE)]
+        self._batch_of = {gid: b for b, chunk in enumerate(self._batches) for gid in chunk}
+        self._pending = [0] * len(self._batches)  # จำนวนครั้งที่ยังจะมีแถวมาขอ
+        for gid in gids:
+            self._pending[self._batch_of[gid]] += 1
+        self._tasks: dict[int, asyncio.Future] = {}
+
+    async def _fetch(self, b: int) -> dict[str, bytes]:
+        xml_txt = await fetch_bytes(
+            self._client, build_thing_api_url(",".join(self._batches[b])), cache=False
+        )
+        items = split_thing_items(xml_txt)
+        if http_cache is not None:
+            for gid, block in items.items():
+                http_cache.put(build_thing_api_url(gid), block)
+        return items
+
+    async def get(self, gid: str) -> bytes:
+        b = self._batch_of.get(gid)
+        if b is None or self._pending[b] <= 0:
+            return await fetch_bytes(self._client, build_thing_api_url(gid))
+        task = self._tasks.get(b)
+        if task is None:
+            task = self._tasks[b] = asyncio.ensure_future(self._fetch(b))
+        try:
+            items = await task
+        finally:
+            self._pending[b] -= 1
+            if self._pending[b] <= 0:
+                self._tasks.pop(b, None)
+        if not items:
+            # ทั้งชุดยิงไม่สำเร็จ → ลองทีละเกม
+            return await fetch_bytes(self._client, build_thing_api_url(gid))
+        return items.get(gid, b"")
+
+
+def parse_all(html_body: bytes, xml_txt: bytes) -> tuple[str, str, dict]:
+    """
+    parse ทุกอย่างของหนึ่งแถว (รันใน ProcessPoolExecutor ได้ จึงต้องเป็นฟังก์ชันระดับ module)
+    รับ HTML เป็น bytes แล้ว decode ในนี้ ถ้ารันใน pool การ decode ทั้งหน้าจะไม่กิน event loop
+    คืน (og_image, primary_image, details) โดยเติม title/description จาก HTML ถ้า XML ไม่มี
+    """
+    html_src = html_body.decode("utf-8", "replace")
+    # HTML หน้าเกม → ภาพ og/primary + title fallback + desc fallback
+    og_img, primary_img = parse_images_from_html(html_src)
+    title_fallback = parse_title_from_html(html_src)
+    desc_fallback = parse_description_from_html(html_src)
+
+    if not xml_txt:
+        details = {
+            "title": title_fallback,
+            "players_min": "",
+            "players_max": "",
+            "time_min": "",
+            "time_max": "",
+            "age_plus": "",
+            "weight_5": "",
+            "description": desc_fallback,
+            "alternate_names": "",
+            "designers": "",
+            "artists": "",
+            "publishers": "",
+        }
+    else:
+        details = parse_detail_from_xml_text(xml_txt)
+        if not details.get("title"):
+            details["title"] = title_fallback
+        if not details.get("description"):
+            details["description"] = desc_fallback
+    return og_img, primary_img, details
+
+
+async def process_row(
+    client: httpx.AsyncClient,
+    url: str,
+    things: ThingBatches | None = None,
+    pool: ProcessPoolExecutor | None = None,
+) -> tuple | None:
+    """
+    ทำหนึ่งแถว: HTML หน้าเกม + XML API (+ gallery) คืนแถวผลลัพธ์ (tuple ตาม OUT_COLUMNS) หรือ None ถ้าข้าม
+    ถ้ามี things จะเอา XML จาก request แบบรวมหลาย id
+    ถ้ามี pool จะ parse ใน process อื่นไปพร้อม ๆ กับโหลด gallery
+    """
+    # 1) HTML หน้าเกม และ XML API เป็นอิสระต่อกัน: ถ้าแงะ gid จาก url ได้ ยิงพร้อมกันเลย
+    gid = extract_gid(url)
+    if gid:
+        xml_job = things.get(gid) if things else fetch_bytes(client, build_thing_api_url(gid))
+        html_body, xml_txt = await asyncio.gather(fetch_bytes(client, url), xml_job)
+    else:
+        html_body, xml_txt = await fetch_bytes(client, url), b""
+    if not html_body:
+        print(f"  skip (HTML fetch failed) {url}")
+        return None
 
-        gallery = []
-        if FETCH_GALLERY:
+    # 2) gid → XML API (แล้ว regex ล้วน)
+    if not gid:
+        m = ID_RE.search(html_body)
+        if not m:
+            print(f"  skip (no gid) {url}")
+            return None
+        gid = m.group(1).decode("ascii")
+        xml_txt = await fetch_bytes(client, build_thing_api_url(gid))
+    if not xml_txt:
+        print(f"  warn: XML API not fetched, fallback to HTML-only values ({url})")
+
+    async def load_gallery() -> list[str]:
+        # 3) Gallery (optional)
+        if not FETCH_GALLERY:
+            return []
         # API ก่อน (ได้รูปชัวร์กว่าและเร็วกว่า)
-            gallery = fetch_gallery_images_via_api(s, url, MAX_GALLERY_IMAGES, size="large", gallery="game", sort="recent")
-            # ไม่เจอค่อย HTML fallback
-            if not gallery:
-                gallery = fetch_gallery_images_regex(s, url, MAX_GALLERY_IMAGES)
-            time.sleep(random.uniform(*GALLERY_DELAY_RANGE))
-
-
-        out_rows.append(
-            {
-                "url": url,
-                "title": details.get("title", ""),
-                "players_min": details.get("players_min", ""),
-                "players_max": details.get("players_max", ""),
-                "time_min": details.get("time_min", ""),
-                "time_max": details.get("time_max", ""),
-                "age_plus": details.get("age_plus", ""),
-                "weight_5": details.get("weight_5", ""),
-                "average_rating": details.get("average_rating", ""),  # <-- NEW
-                "description": details.get("description", ""),
-                "og_image": og_img,
-                "primary_image": primary_img,
-                "gallery_images": " | ".join(gallery),
-                "alternate_names": details.get("alternate_names", ""),
-                "designers": details.get("designers", ""),
-                "artists": details.get("artists", ""),
-                "publishers": details.get("publishers", ""),
-            }
+        gallery = await fetch_gallery_images_via_api(client, gid, MAX_GALLERY_IMAGES, size="large", gallery="game", sort="recent")
+        # ไม่เจอค่อย HTML fallback
+        if not gallery:
+            gallery = await fetch_gallery_images_regex(client, gid, MAX_GALLERY_IMAGES)
+        return gallery
+
+    if pool is not None:
+        loop = asyncio.get_running_loop()
+        (og_img, primary_img, details), gallery = await asyncio.gather(
+            loop.run_in_executor(pool, parse_all, html_body, xml_txt), load_gallery()
         )
+    else:
+        og_img, primary_img, details = parse_all(html_body, xml_txt)
+        gallery = await load_gallery()
+
+    return to_row(url, details, og_img, primary_img, gallery)
+
+
+def to_row(url: str, details: dict, og_img: str, primary_img: str, gallery: list[str]) -> tuple:
+    """เรียงค่าของหนึ่งแถวตาม OUT_COLUMNS"""
+    get = details.get
+    return (
+        url,
+        get("title", ""),
+        get("players_min", ""),
+        get("players_max", ""),
+        get("time_min", ""),
+        get("time_max", ""),
+        get("age_plus", ""),
+        get("weight_5", ""),
+        get("average_rating", ""),
+        get("description", ""),
+        og_img,
+        primary_img,
+        " | ".join(gallery),
+        get("alternate_names", ""),
+        get("designers", ""),
+        get("artists", ""),
+        get("publishers", ""),
+    )
+
+
+def truncate_partial_row(path: str):
+    """ถ้ารอบก่อนตายกลางแถว (ไฟล์ไม่จบด้วย newline) ตัดแถวที่เขียนไม่จบทิ้ง ก่อนจะ append ต่อ"""
+    with open(path, "rb+") as fb:
+        end = fb.seek(0, os.SEEK_END)
+        if not end:
+            return
+        fb.seek(-1, os.SEEK_END)
+        if fb.read(1) == b"\n":
+            return
+        # ถอยหลังจากท้ายไฟล์ทีละ STREAM_CHUNK จนเจอ newline (ไม่ต้องอ่านทั้งไฟล์เข้า memory)
+        while end > 0:
+            start = max(0, end - STREAM_CHUNK)
+            fb.seek(start)
+            i = fb.read(end - start).rfind(b"\n")
+            if i >= 0:
+                fb.truncate(start + i + 1)
+                return
+            end = start
+        fb.truncate(0)
+
+
+def load_done_urls(path: str) -> set[str]:
+    """อ่าน url ที่อยู่ใน OUTPUT_CSV ของรอบก่อน (แถวไม่ครบคอลัมน์ไม่นับ)"""
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return {row[0] for row in csv.reader(f) if len(row) == len(OUT_COLUMNS)} - {"url"}
+
+
+async def write_rows(queue: asyncio.Queue, f, w) -> int:
+    """
+    consumer ตัวเดียวของผลลัพธ์: รับ row จากคิวแล้วเขียนตามลำดับที่เสร็จ จนเจอ None
+    (ไม่พักแถวรอลำดับ input: แถวที่ติด backoff จะไม่ดึงแถวอื่นค้างไว้ในหน่วยความจำ resume ก็อิง url อยู่แล้ว)
+    flush ทุก FLUSH_EVERY แถว คืนจำนวนแถวที่เขียน
+    """
+    written = 0
+    while (row := await queue.get()) is not None:
+        w.writerow(row)
+        written += 1
+        if written % FLUSH_EVERY == 0:
+            f.flush()
+    return written
+
 
-        time.sleep(random.uniform(*PAGE_DELAY_RANGE))
-
-    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
-        fieldnames = [
-            "url",
-            "title",
-            "players_min",
-            "players_max",
-            "time_min",
-            "time_max",
-            "age_plus",
-            "weight_5",
-            "average_rating",  # <-- NEW
-            "description",
-            "og_image",
-            "primary_image",
-            "gallery_images",
-            "alternate_names",
-            "designers",
-            "artists",
-            "publishers",
-        ]
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        w.writerows(out_rows)
+# --------------- Main -------------------
+async def main():
+    global http_cache
+
+    with open(INPUT_CSV, "r", encoding="utf-8") as f:
+        in_rows = list(csv.DictReader(f))
+
+    n = len(in_rows)
+    row_sem = asyncio.Semaphore(ROW_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue()
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_KEEPALIVE
+    )
+
+    # HTTP/2: หน้าเกม + XML + gallery ของ host เดียวกัน multiplex บน connection เดียว
+    transport = httpx.AsyncHTTPTransport(
+        http2=True, limits=limits, socket_options=HTTP_SOCKET_OPTIONS
+    )
+    done = set()
+    if RESUME and os.path.exists(OUTPUT_CSV):
+        truncate_partial_row(OUTPUT_CSV)
+        done = load_done_urls(OUTPUT_CSV)
+    if done:
+        print(f"Resume: skip {len(done)} urls already in {OUTPUT_CSV}")
+
+    http_cache = HttpCache(HTTP_CACHE_PATH) if HTTP_CACHE_PATH else None
+    pool = None
+    try:
+        with open(OUTPUT_CSV, "a" if done else "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            if not done:
+                w.writerow(OUT_COLUMNS)
+
+            pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS) if PARSE_WORKERS else None
+            async with httpx.AsyncClient(
+                transport=transport, headers=HTTP_HEADERS, follow_redirects=True
+            ) as client:
+
+                async def run(i: int, url: str):
+                    async with row_sem:
+                        print(f"[{i}/{n}] {url}")
+                        try:
+                            row = await process_row(client, url, things, pool)
+                        except Exception as e:
+                            # แถวเดียวพังต้องไม่ล้มทั้งรอบ (gather จะยกเลิกทุกแถวที่ยังวิ่งอยู่)
+                            print(f"  row failed: {e!r} ({url})")
+                            row = None
+                    if row is not None:
+                        await queue.put(row)
+
+                jobs = []
+                for i, row in enumerate(in_rows, 1):
+                    url = (row.get("url") or "").strip()
+                    if url and to_abs(url) not in done:
+                        jobs.append((i, to_abs(url)))
+                # gid ที่รู้จาก url ล่วงหน้า → ดึง XML แบบรวมชุด
+                things = ThingBatches(client, [gid for _, url in jobs if (gid := extract_gid(url))])
+
+                writer = asyncio.create_task(write_rows(queue, f, w))
+                tasks = [asyncio.create_task(run(i, url)) for i, url in jobs]
+                await asyncio.gather(*tasks)
+                await queue.put(None)
+                written = await writer
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if http_cache is not None:
+            http_cache.close()
 
     print(f"Saved -> {OUTPUT_CSV}")
-    print("Total items:", len(out_rows))
+    print("Total items:", written)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())